@@ -1,25 +1,39 @@
 #!/usr/bin/env python3
 
 import argparse
+import concurrent.futures
+import functools
 import ipaddress
 import json
+import os
 import pymysql
 import socket
 import sys
+import tempfile
+import time
+
+try:
+    # C serializer, several times faster than stdlib json on big payloads;
+    # fall back to stdlib when unavailable
+    import orjson
+except ImportError:
+    orjson = None
 
 '''
-usage: inventory.py [-h] [-l] {get,add} ...
+usage: inventory.py [-h] [-l] [--host HOST] {get,add} ...
 
 Retrieve and insert dynamic inventory hosts
 
 positional arguments:
   {get,add}
-    get       retrieve hosts or groups
-    add       write new hosts to inventory
+    get          retrieve hosts or groups
+    add          write new hosts to inventory
 
 optional arguments:
-  -h, --help  show this help message and exit
-  -l, --list  output entire inventory
+  -h, --help   show this help message and exit
+  -l, --list   output entire inventory
+  --host HOST  no-op for the Ansible contract; hostvars are served inline
+               via _meta on --list
 
 =====
 
@@ -33,24 +47,6 @@ Usage with Ansible:
 '''
 
 
-class Host:
-    def __init__(self, id, fqdn, enabled, features, ipaddr, label, groups, upd):
-        self.id = id
-        self.fqdn = fqdn
-        self.upd = upd
-
-        # convert mysql int-based boolean to real boolean
-        self.enabled = True if enabled else False
-
-        # create objects from parsable fields
-        self.ipaddr = ipaddress.ip_address(ipaddr)
-
-        # return empty data types if Null in table
-        self.groups = groups.split(',') if groups else []
-        self.features = features.split(',') if features else []
-        self.label = label if label else ''
-
-
 def parse_args():
     parser = argparse.ArgumentParser(
         description='Retrieve and insert dynamic inventory hosts'
@@ -65,6 +61,13 @@ def parse_args():
         '-l', '--list', help='output entire inventory', action='store_true'
     )
 
+    # Ansible only calls `--host` when `--list` lacks _meta.hostvars; ours
+    # includes it, so this exists purely to satisfy the contract and answers
+    # with an empty dict rather than a per-host DB query
+    parser.add_argument(
+        '--host', metavar='HOST', help='no-op for the Ansible contract; hostvars are served inline via _meta on --list', type=str
+    )
+
     get = subparsers.add_parser(
         'get', help='retrieve hosts or groups'
     )
@@ -92,7 +95,7 @@ def parse_args():
         'add', help='write new hosts to inventory'
     )
     add.add_argument(
-        'name', metavar='NAME', help='fully-qualified domain name (FQDN) of host', type=str, nargs=1
+        'name', metavar='NAME', help='fully-qualified domain name (FQDN) of host; multiple may be given', type=str, nargs='+'
     )
     add.add_argument(
         '-i', '--ipaddr', help='ip address of host; if not provided will attempt to resolve ip from FQDN', type=str, required=False
@@ -112,47 +115,124 @@ def parse_args():
 
     try:
         args = parser.parse_args()
-        if not args.subparser and not args.list:
-            parser.error('requires one of {get,add}, or -l/--list')
+        if not args.subparser and not args.list and not args.host:
+            parser.error('requires one of {get,add}, -l/--list, or --host')
         if args.subparser == 'get' and not args.get_subparser:
             get.error('required one of {host,group}')
+        if args.subparser == 'add' and args.ipaddr and len(args.name) > 1:
+            add.error('-i/--ipaddr is only valid with a single NAME')
+        if args.subparser == 'add' and args.ipaddr:
+            # validate untrusted input once on write; the read path trusts
+            # the column and never re-parses it
+            try:
+                ipaddress.ip_address(args.ipaddr)
+            except ValueError:
+                add.error('invalid ip address {}'.format(args.ipaddr))
         return args
     except argparse.ArgumentTypeError as err:
         parser.error(err.args[1])
 
 
-def connect_db(
-    host='127.0.0.1',
-    port=3306,
-    user='root',
-    passwd='password',
-    db='db'
-):
-    db = pymysql.connect(
-        host=host,
-        port=port,
-        user=user,
-        passwd=passwd,
-        db=db,
-        connect_timeout=10
-    )
+# per-user filename so one user can't pre-seed a cache another user's
+# Ansible run would consume from the world-shared temp dir
+CACHE_PATH = os.path.join(
+    tempfile.gettempdir(), 'dynamic_inv_{}.json'.format(os.getuid()))
+CACHE_TTL = int(os.environ.get('INVENTORY_CACHE_TTL', 300))
+
+# connection settings are read from the environment once at import so every
+# caller shares the same configuration (and the same pool) and credentials
+# stay out of source
+DB_CONFIG = {
+    'host': os.environ.get('MYSQL_HOST', '127.0.0.1'),
+    'port': int(os.environ.get('MYSQL_PORT', 3306)),
+    'user': os.environ.get('MYSQL_USER', 'root'),
+    'passwd': os.environ.get('MYSQL_PASSWD', 'password'),
+    'db': os.environ.get('MYSQL_DB', 'db'),
+}
+
+_pool = None
+
+
+def read_cache():
+    # serve a recent rendering of the full inventory without touching the
+    # DB; anyone can pre-create this path in the sticky shared temp dir, so
+    # O_NOFOLLOW plus an ownership check on the opened fd makes sure we only
+    # ever trust a cache file this uid actually wrote
+    try:
+        with os.fdopen(
+            os.open(CACHE_PATH, os.O_RDONLY | os.O_NOFOLLOW), 'rb'
+        ) as cache:
+            stat = os.fstat(cache.fileno())
+            if (stat.st_uid == os.getuid()
+                    and stat.st_mtime > time.time() - CACHE_TTL):
+                return cache.read()
+    except OSError:
+        pass
+    return None
+
+
+def write_cache(output):
+    # write to a unique temp file then rename: concurrent writers can't
+    # truncate each other mid-write and readers never see partial JSON; a
+    # failed cache write shouldn't fail the run, the output still prints
+    try:
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(CACHE_PATH), prefix='dynamic_inv.')
+        with os.fdopen(fd, 'wb') as cache:
+            cache.write(output)
+        os.replace(tmp_path, CACHE_PATH)
+    except OSError:
+        pass
+
+
+def get_pool():
+    # lazily build the shared connection pool on first use so one-shot
+    # invocations that never opt in don't pay the import or warm-up cost
+    global _pool
+    if _pool is None:
+        from dbutils.pooled_db import PooledDB
+        _pool = PooledDB(
+            creator=pymysql,
+            mincached=2,
+            maxcached=5,
+            maxconnections=10,
+            connect_timeout=10,
+            **DB_CONFIG
+        )
+    return _pool
+
+
+def connect_db():
+    # long-lived callers (e.g. an inventory caching daemon) can opt into
+    # pooling with INVENTORY_POOL=1; close() on a pooled connection returns
+    # it to the pool instead of tearing down the TCP session
+    if os.environ.get('INVENTORY_POOL') == '1':
+        return get_pool().connection()
+    db = pymysql.connect(connect_timeout=10, **DB_CONFIG)
     return db
 
 
-def read_query(db, query):
-    cur = db.cursor(pymysql.cursors.DictCursor)
-    cur.execute(query)
-    output = cur.fetchall()
-    cur.close()
-    return output
+def read_query(db, query, params=None):
+    # server-side cursor: rows stream from MySQL as the generator is
+    # consumed instead of being materialized client-side up front; close
+    # in finally so an interrupted or abandoned consumer can't leak it
+    cur = db.cursor(pymysql.cursors.SSDictCursor)
+    try:
+        cur.execute(query, params or ())
+        yield from cur
+    finally:
+        cur.close()
 
 
-def write_query(db, query):
+def write_query(db, query, rows):
+    # the caller owns the transaction and commits once all its statements
+    # have run; exiting here without a commit rolls everything back
     cur = db.cursor()
     try:
-        cur.execute(query)
-        db.commit()
+        cur.executemany(query, rows)
+        first_id = cur.lastrowid
         cur.close()
+        return first_id
     except Exception as err:
         print('ERROR:', err.args[1])
         cur.close()
@@ -160,55 +240,97 @@ def write_query(db, query):
         sys.exit(1)
 
 
-def get_hosts(
-    where='1 = 1',
-    select='`id`, `fqdn`, `enabled`, `features`, `ipaddr`, `label`, `groups`, `upd`'
-):
+def get_hosts(fqdn_prefix=None):
+    # push filtering into the WHERE clause so the DB only transfers matching
+    # rows (and can use an index on fqdn) instead of shipping the whole
+    # table for Python to discard
+    where, params = '1 = 1', ()
+    if fqdn_prefix:
+        # escape LIKE metacharacters so the prefix matches literally and
+        # only the trailing % we append acts as a wildcard
+        prefix = fqdn_prefix.replace('\\', '\\\\').replace(
+            '%', '\\%').replace('_', '\\_')
+        where, params = '`fqdn` LIKE %s', (prefix + '%',)
     db = connect_db()
-    query = 'SELECT {select} FROM `server_inventory` WHERE {where} ;'.format(
-        select=select, where=where)
-    host_list = read_query(db, query)
-    db.close()
-    return host_list
-
-
-def process_hosts(host_list):
-    hosts = []
-    for host in host_list:
-        hosts.append(
-            Host(
-                id=host['id'],
-                fqdn=host['fqdn'],
-                enabled=host['enabled'],
-                features=host['features'],
-                ipaddr=host['ipaddr'],
-                label=host['label'],
-                groups=host['groups'],
-                upd=host['upd']
-            )
-        )
-    return hosts
+    query = (
+        'SELECT `id`, `fqdn`, `enabled`, `features`, `ipaddr`, `label`, '
+        '`groups`, `upd` FROM `server_inventory` WHERE {where} ;'.format(
+            where=where)
+    )
+    try:
+        yield from read_query(db, query, params)
+    finally:
+        db.close()
 
 
-def build_hostvars(hosts):
-    hostvars = {}
-    for host in hosts:
-        host_dict = host.__dict__.copy()
-        del host_dict['fqdn']
-        host_dict['upd'] = host_dict['upd'].strftime('%Y-%d-%m %H:%M:%S')
-        host_dict['ipaddr'] = host_dict['ipaddr'].exploded
-        hostvars[host.fqdn] = host_dict
-    return hostvars
+def get_groups(name=None):
+    # the join table lets the DB filter memberships on its group_name
+    # index; the rows come back as plain (group_name, fqdn) pairs and are
+    # folded into the mapping here — a GROUP_CONCAT aggregate would be
+    # silently truncated at group_concat_max_len (1024 bytes by default,
+    # a couple dozen fqdns) on exactly the inventory sizes that matter
+    where, params = '', ()
+    if name:
+        where, params = 'WHERE `group_name` = %s ', (name,)
+    db = connect_db()
+    query = (
+        'SELECT `group_name`, `fqdn` '
+        'FROM `host_groups` JOIN `server_inventory` '
+        'ON `host_id` = `server_inventory`.`id` '
+        '{where};'.format(where=where)
+    )
+    groups = {}
+    try:
+        for row in read_query(db, query, params):
+            groups.setdefault(
+                row['group_name'], {'hosts': []})['hosts'].append(row['fqdn'])
+    finally:
+        db.close()
+    return groups
+
+
+@functools.lru_cache(maxsize=4096)
+def split_csv(value):
+    # group/feature strings like 'prod,web' recur across many hosts, so
+    # cache the split and hand every caller the same list; callers only
+    # read and serialize these lists, never mutate them
+    return value.split(',') if value else []
 
 
-def build_groups(hosts):
+def build_inventory(rows):
+    # single fused pass over the streaming rows: normalize each row, file
+    # it under its fqdn, and invert its group memberships while the row is
+    # still hot, instead of walking the host list three times
     groups = {}
-    for host in hosts:
-        for group in host.groups:
-            if group not in groups:
-                groups[group] = {'hosts': []}
-            groups[group]['hosts'].append(host.fqdn)
-    return groups
+    hostvars = {}
+    for host in rows:
+        fqdn = host.pop('fqdn')
+
+        # convert mysql int-based boolean to real boolean
+        host['enabled'] = True if host['enabled'] else False
+
+        # return empty data types if Null in table; the `ipaddr` column is
+        # already a dotted-quad string, so no ipaddress round-trip on read
+        host['groups'] = split_csv(host['groups'])
+        host['features'] = split_csv(host['features'])
+        host['label'] = host['label'] if host['label'] else ''
+
+        host['upd'] = host['upd'].strftime('%Y-%d-%m %H:%M:%S')
+
+        hostvars[fqdn] = host
+        for group in host['groups']:
+            # setdefault does the membership test and the lookup in one
+            # hash probe instead of two
+            groups.setdefault(group, {'hosts': []})['hosts'].append(fqdn)
+    return groups, hostvars
+
+
+try:
+    # compiled fast path, built from inventory_fast.pyx with
+    # `python setup.py build_ext --inplace`; same behavior as above
+    from inventory_fast import build_inventory
+except ImportError:
+    pass
 
 
 def build_ansible_inventory(groups, hostvars):
@@ -219,84 +341,122 @@ def build_ansible_inventory(groups, hostvars):
     return inventory
 
 
-def add_host(name, ipaddr=None, groups=None, features=None, label=None, disabled=False):
+def resolve_ip(name):
+    try:
+        return socket.gethostbyname(name)
+    except socket.gaierror as err:
+        print('ERROR:', err.args[1])
+        sys.exit(1)
+
+
+def add_hosts(rows):
+    # rows are (fqdn, ipaddr, groups, features, label, enabled) tuples;
+    # a single executemany collapses N inserts into one round trip, and
+    # parameter binding replaces the old hand-rolled value quoting
     db = connect_db()
-    fields = ['fqdn', 'ipaddr']
-    values = [name]
-    if ipaddr:
-        values.append(ipaddr)
-    else:
-        try:
-            values.append(
-                socket.gethostbyname(name)
-            )
-        except socket.gaierror as err:
-            print('ERROR:', err.args[1])
-            db.close()
-            sys.exit(1)
-    if groups:
-        fields.append('groups')
-        values.append(groups)
-    if features:
-        fields.append('features')
-        values.append(features)
-    if label:
-        fields.append('label')
-        values.append(label)
-    if disabled:
-        fields.append('enabled')
-        values.append(0)
-
-    fields = ','.join(['`{}`'.format(x) for x in fields])
-    values = ','.join(["'{}'".format(x) if isinstance(
-        x, str) else str(x) for x in values])
-
-    query = 'INSERT INTO `server_inventory` ({fields}) VALUES ({values});'.format(
-        fields=fields, values=values)
-    write_query(db, query)
+    query = (
+        'INSERT INTO `server_inventory` '
+        '(`fqdn`, `ipaddr`, `groups`, `features`, `label`, `enabled`) '
+        'VALUES (%s, %s, %s, %s, %s, %s);'
+    )
+    first_id = write_query(db, query, rows)
+
+    # mirror each new host's memberships into the host_groups join table
+    # so group queries can use the indexed aggregate; a single multi-row
+    # INSERT assigns consecutive ids starting at lastrowid, so memberships
+    # come from the rows just written — re-selecting by fqdn would also
+    # match any pre-existing rows sharing the name and duplicate theirs
+    memberships = [
+        (first_id + offset, group)
+        for offset, row in enumerate(rows)
+        for group in split_csv(row[2])
+    ]
+    if memberships:
+        write_query(
+            db,
+            'INSERT INTO `host_groups` (`host_id`, `group_name`) '
+            'VALUES (%s, %s);',
+            memberships
+        )
+
+    # one commit covering both inserts: if the membership mirror fails,
+    # the host rows roll back with it instead of landing with groups that
+    # get group would never return
+    db.commit()
     db.close()
 
 
-def dump(data):
-    if isinstance(data, dict):
-        output = json.dumps(data)
-        print(output)
-    elif isinstance(data, (tuple, list, type({}.keys()))):
-        output = sorted(data)
-        print(*output, sep='\n')
+def dump_json(data):
+    # stream straight to stdout instead of building the serialized
+    # string and then a second full-size copy inside print
+    if orjson is not None:
+        sys.stdout.buffer.write(orjson.dumps(data))
+        sys.stdout.buffer.write(b'\n')
+    else:
+        json.dump(data, sys.stdout)
+        sys.stdout.write('\n')
+
+
+def dump_lines(data):
+    sys.stdout.writelines('{}\n'.format(item) for item in sorted(data))
 
 
 def main(args):
+    if args.host:
+        # all hostvars are already inlined under _meta on --list, so there
+        # is nothing per-host to add and no reason to touch the DB
+        print('{}')
+        return
     if args.subparser and args.subparser == 'add':
-        add_host(args.name[0], args.ipaddr, args.groups,
-                 args.features, args.label, args.disabled)
-    elif not args.subparser or args.subparser == 'get':
-        hosts = process_hosts(get_hosts())
-        groups = build_groups(hosts)
-        hostvars = build_hostvars(hosts)
-        if args.subparser:
-            if args.get_subparser == 'host':
-                if args.name[0] != 'all':
-                    host_subset = [
-                        host.fqdn for host in hosts if host.fqdn.startswith(args.name[0])]
-                    hostvar_subset = {}
-                    for host in host_subset:
-                        hostvar_subset[host] = hostvars[host]
-                    dump(hostvar_subset)
-                else:
-                    dump(hostvars)
-            elif args.get_subparser == 'group':
-                if args.list:
-                    dump(groups.keys())
-                else:
-                    try:
-                        group_hosts = groups[args.name]['hosts']
-                    except KeyError:
-                        print('No group matching {}'.format(args.name))
-                        sys.exit(1)
-                    dump(group_hosts)
-        elif args.list:
-            dump(build_ansible_inventory(groups, hostvars))
+        enabled = 0 if args.disabled else 1
+        if args.ipaddr:
+            ipaddrs = [args.ipaddr]
+        elif len(args.name) > 1:
+            # overlap the per-host DNS round trips instead of resolving
+            # serially; the single-name case skips the executor overhead
+            with concurrent.futures.ThreadPoolExecutor() as executor:
+                ipaddrs = list(executor.map(resolve_ip, args.name))
+        else:
+            ipaddrs = [resolve_ip(args.name[0])]
+        rows = [
+            (name, ipaddr, args.groups, args.features, args.label, enabled)
+            for name, ipaddr in zip(args.name, ipaddrs)
+        ]
+        add_hosts(rows)
+    elif args.subparser == 'get':
+        if args.get_subparser == 'host':
+            if args.name[0] != 'all':
+                # prefix matching happens in SQL; only the matching rows
+                # are transferred and processed
+                groups, hostvars = build_inventory(
+                    get_hosts(fqdn_prefix=args.name[0]))
+            else:
+                groups, hostvars = build_inventory(get_hosts())
+            dump_json(hostvars)
+        elif args.get_subparser == 'group':
+            if args.list:
+                dump_lines(get_groups().keys())
+            else:
+                groups = get_groups(args.name)
+                if not groups:
+                    print('No group matching {}'.format(args.name))
+                    sys.exit(1)
+                dump_lines(groups[args.name]['hosts'])
+    elif args.list:
+        cached = read_cache()
+        if cached is not None:
+            sys.stdout.buffer.write(cached)
+            return
+        groups, hostvars = build_inventory(get_hosts())
+        inventory = build_ansible_inventory(groups, hostvars)
+        # the cache needs the serialized bytes anyway, so serialize once
+        # and hand the same buffer to the cache file and stdout
+        if orjson is not None:
+            output = orjson.dumps(inventory) + b'\n'
+        else:
+            output = (json.dumps(inventory) + '\n').encode()
+        write_cache(output)
+        sys.stdout.buffer.write(output)
 
 
 if __name__ == '__main__':
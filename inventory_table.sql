@@ -8,3 +8,27 @@ CREATE TABLE `db`.`server_inventory` (
   `groups` VARCHAR(45) NULL,
   `upd` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
   PRIMARY KEY (`id`));
+
+CREATE TABLE `db`.`host_groups` (
+  `host_id` INT NOT NULL,
+  `group_name` VARCHAR(45) NOT NULL,
+  INDEX (`group_name`),
+  FOREIGN KEY (`host_id`) REFERENCES `db`.`server_inventory` (`id`));
+
+-- one-shot backfill for deployments that predate host_groups: expand the
+-- CSV `groups` column into one membership row per group (MySQL 8.0+)
+INSERT INTO `db`.`host_groups` (`host_id`, `group_name`)
+WITH RECURSIVE split (host_id, group_name, rest) AS (
+  SELECT `id`,
+         SUBSTRING_INDEX(`groups`, ',', 1),
+         SUBSTRING(`groups`, CHAR_LENGTH(SUBSTRING_INDEX(`groups`, ',', 1)) + 2)
+  FROM `db`.`server_inventory`
+  WHERE `groups` IS NOT NULL AND `groups` <> ''
+  UNION ALL
+  SELECT host_id,
+         SUBSTRING_INDEX(rest, ',', 1),
+         SUBSTRING(rest, CHAR_LENGTH(SUBSTRING_INDEX(rest, ',', 1)) + 2)
+  FROM split
+  WHERE rest <> ''
+)
+SELECT host_id, group_name FROM split;
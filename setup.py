@@ -0,0 +1,12 @@
+#!/usr/bin/env python3
+
+# builds the optional compiled fast path for inventory.py:
+#     python setup.py build_ext --inplace
+
+from setuptools import setup
+from Cython.Build import cythonize
+
+setup(
+    name='inventory_fast',
+    ext_modules=cythonize('inventory_fast.pyx', language_level=3)
+)